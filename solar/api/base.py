@@ -1,21 +1,47 @@
-import json
+import asyncio
 import logging
-from typing import List, Optional
+import operator
+import pathlib
+import random
+import time
+from typing import Dict, List, Optional, Tuple, Type, TypeVar
 
 import aiohttp
 import orjson
 from more_itertools import chunked
+from yarl import URL
 
 from solar.types.analysis import AnalysisModel
 from solar.types.cluster_status import ClusterStatus
+from solar.utils import run_in_thread
 
 # requests.packages.urllib3.disable_warnings()  # type: ignore
 logger = logging.getLogger("root")
 
+E = TypeVar("E", bound="ApiEngine")
+
+# Solr (or load balancer in front of it) is overloaded, request can be repeated
+RETRY_STATUSES = frozenset((429, 503))
+
+
+def _orjson_dumps(obj) -> str:
+    """JSON serializer for `json=` request bodies"""
+    return orjson.dumps(obj).decode("utf-8")
+
 
 class ApiEngine:
     """Base class for working with API Solr"""
 
+    # seconds to reuse fetched cluster status
+    cluster_status_ttl: float = 5.0
+    # seconds to wait for next chunk of response, before request fails.
+    # Total request time is not limited, so long exports are not cut off
+    read_timeout: float = 300.0
+    # retries of requests rejected by overloaded Solr (429 / 503) or dropped connections
+    max_retries: int = 4
+    # base delay in seconds, doubled on every retry
+    retry_backoff: float = 0.2
+
     def __init__(
         self,
         base_url: str,
@@ -23,13 +49,38 @@ class ApiEngine:
         username: Optional[str] = None,
         password: Optional[str] = None,
         id_col: str = "id",
+        pool_size: int = 32,
     ) -> None:
         self.base_url = base_url
         self.collection = collection
         self.username = username
         self.password = password
         self.id_col = id_col
+        self.pool_size = pool_size
         self.client = None
+        self._shared_client = False
+        self._cluster_status: Optional[Tuple[float, dict]] = None
+        self._urls: Dict[str, URL] = {}
+
+    @classmethod
+    def from_engine(cls: Type[E], engine: "ApiEngine") -> E:
+        """Create API object with connection params of `engine`.
+        If `engine` client is already built, it is shared between both objects
+        and only `engine` closes it
+        """
+        api = cls(
+            base_url=engine.base_url,
+            collection=engine.collection,  # type: ignore
+            username=engine.username,
+            password=engine.password,
+            id_col=engine.id_col,
+            pool_size=engine.pool_size,
+        )
+        if engine.client is not None:
+            api.client = engine.client
+            api._shared_client = True
+
+        return api
 
     async def build_client(self):
         """
@@ -42,14 +93,29 @@ class ApiEngine:
         else:
             auth = None
 
+        # connections to Solr are kept alive and reused between requests
+        connector = aiohttp.TCPConnector(
+            ssl=False,
+            limit=self.pool_size,
+            limit_per_host=self.pool_size,
+            ttl_dns_cache=300,
+            keepalive_timeout=60,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=None, sock_connect=10, sock_read=self.read_timeout
+        )
+
         self.client: Optional[aiohttp.ClientSession] = aiohttp.ClientSession(
-            auth=auth, connector=aiohttp.TCPConnector(verify_ssl=False)
+            auth=auth,
+            connector=connector,
+            timeout=timeout,
+            json_serialize=_orjson_dumps,
         )
 
     async def close_client(self):
         """Close aiohttp client and free resources"""
 
-        if self.client is None:
+        if self.client is None or self._shared_client:
             return
 
         await self.client.close()
@@ -76,92 +142,225 @@ class ApiEngine:
         data = orjson.loads(content)
 
         body = data["response"]
-        ids = [i["id"] for i in body["docs"]]
+        ids = list(map(operator.itemgetter(self.id_col), body["docs"]))
         return ids
 
+    def _url(self, path: str) -> URL:
+        """Parsed URL of `path`, cached to skip parsing on repeated requests"""
+        url = self._urls.get(path)
+        if url is None:
+            url = self._urls[path] = URL(self.base_url + path)
+        return url
+
     async def api_request(
         self,
         *,
         path: str,
-        params: dict = {},
+        params: Optional[dict] = None,
         method: str = "GET",
+        max_retries: Optional[int] = None,
         **kwargs,
-    ) -> Optional[str]:
+    ) -> Optional[bytes]:
         """Create request to Solr API
 
         Args:
             path (str): URL path
-            params (dict, optional): query params.
-                Defaults to {}.
+            params (Optional[dict], optional): query params.
+                Defaults to None.
             method (str, optional): request method (GET, POST, etc...).
                 Defaults to "GET".
+            max_retries (Optional[int], optional): retries of failed request,
+                0 for requests, which are not safe to repeat.
+                Defaults to None (`.max_retries`).
 
         Raises:
             ValueError: .build_client() is not called before request
 
         Returns:
-            Optional[aiohttp.ClientResponse]: Solr response.
-                If None - response status code is >= 400
+            Optional[bytes]: raw Solr response body.
+                If None - response status code is not 200
         """
         if self.client is None:
             raise ValueError(".build_client() have to be called before request")
 
-        async with self.client.request(
-            method=method,
-            url=self.base_url + path,
-            params=params,
-            **kwargs,
-        ) as resp:
-            if resp.status == 401:
-                raise ValueError("Auth error :(")
+        url = self._url(path)
+        # aiohttp consumes and closes streamed (file-like) bodies,
+        # so only requests with in-memory body can be sent again
+        if max_retries is None:
+            max_retries = self.max_retries
+
+        if not isinstance(kwargs.get("data"), (bytes, type(None))):
+            max_retries = 0
+
+        for attempt in range(max_retries + 1):
+            last_attempt = attempt == max_retries
+            if attempt:
+                await self._retry_delay(attempt)
+
+            try:
+                async with self.client.request(
+                    method=method,
+                    url=url,
+                    params=params,
+                    **kwargs,
+                ) as resp:
+                    if resp.status in RETRY_STATUSES and not last_attempt:
+                        logger.warning(
+                            f"{method} - {resp.url} - {resp.status}, retrying"
+                        )
+                        continue
+
+                    if not await self._check_response(resp, method):
+                        return None
+
+                    return await resp.read()
+            except aiohttp.ClientConnectionError as e:
+                if last_attempt or not self._is_retryable(e, method, path):
+                    raise
+
+                logger.warning(f"{method} - {url} - connection error, retrying")
+
+    @staticmethod
+    def _is_retryable(error: Exception, method: str, path: str) -> bool:
+        """Connection error can be retried, if request was never sent,
+        or if it is safe to repeat (reads and documents updates).
+        Timeouts are not retried, so stalled node is not waited for again"""
+        if isinstance(error, aiohttp.ServerTimeoutError):
+            return False
+
+        if isinstance(error, aiohttp.ClientConnectorError):
+            return True
+
+        return method == "GET" or "/update" in path
+
+    async def _retry_delay(self, attempt: int):
+        """Sleep before `attempt` retry with exponential backoff and jitter"""
+        delay = self.retry_backoff * 2 ** (attempt - 1)
+        await asyncio.sleep(delay + random.uniform(0, self.retry_backoff))
+
+    async def download_to_file(
+        self,
+        *,
+        path: str,
+        file_path: pathlib.Path,
+        params: Optional[dict] = None,
+        chunk_size: int = 64 * 1024,
+    ) -> bool:
+        """Stream response body of GET request to `file_path`
+        chunk by chunk, without loading it to memory
+
+        Args:
+            path (str): URL path
+            file_path (pathlib.Path): file to save response body to
+            params (Optional[dict], optional): query params.
+                Defaults to None.
+            chunk_size (int, optional): size of chunks to read from response.
+                Defaults to 64 KiB.
+
+        Raises:
+            ValueError: .build_client() is not called before request
+
+        Returns:
+            bool: False if response status code is not 200
+        """
+        if self.client is None:
+            raise ValueError(".build_client() have to be called before request")
 
-            if resp.status != 200:
-                text = await resp.text()
-                logger.error(f"{method} - {resp.url} - {text}")
-                return None
+        async with self.client.get(url=self._url(path), params=params) as resp:
+            if not await self._check_response(resp, "GET"):
+                return False
 
+            f = await run_in_thread(open, file_path, "wb")
             try:
-                return await resp.text(encoding="UTF-8")
-            except UnicodeDecodeError as e:
-                print("Can't decode answer :( {e}")
-                return None
+                async for chunk in resp.content.iter_chunked(chunk_size):
+                    await run_in_thread(f.write, chunk)
+            finally:
+                await run_in_thread(f.close)
+
+        return True
+
+    async def _check_response(self, resp: aiohttp.ClientResponse, method: str) -> bool:
+        """Check Solr response status. Errors are logged
+
+        Raises:
+            ValueError: authentication failed
+
+        Returns:
+            bool: True if response status code is 200
+        """
+        if resp.status == 401:
+            raise ValueError("Auth error :(")
+
+        if resp.status != 200:
+            text = await resp.text()
+            logger.error(f"{method} - {resp.url} - {text}")
+            return False
+
+        return True
+
+    def _invalidate_cluster_status(self):
+        self._cluster_status = None
 
     async def remove_collection(self, collection_name: str):
         url = f"/solr/admin/collections?action=DELETE&name={collection_name}"
-        await self.api_request(path=url)
+        await self.api_request(path=url, max_retries=0)
+        self._invalidate_cluster_status()
 
     async def reload_collection(self, collection_name: str):
         url = f"/solr/admin/collections?action=RELOAD&name={collection_name}"
         await self.api_request(path=url)
+        self._invalidate_cluster_status()
+
+    async def cluster_status_raw(self, force_refresh: bool = False) -> dict:
+        """Fetch cluster status as parsed JSON, without model validation.
+        Result is cached for `cluster_status_ttl` seconds
+        and reset by collection / alias modifications
+
+        Args:
+            force_refresh (bool, optional): ignore cached status.
+                Defaults to False.
+        """
+        if self._cluster_status is not None and not force_refresh:
+            fetched_at, status = self._cluster_status
+            if time.monotonic() - fetched_at < self.cluster_status_ttl:
+                return status
 
-    async def cluster_status(self) -> ClusterStatus:
         url = f"/solr/admin/collections?action=CLUSTERSTATUS&wt=json"
-        status = await self.api_request(
+        resp = await self.api_request(
             path=url,
         )
-        if status is None:
+        if resp is None:
             raise ValueError("Error getting cluster status")
 
-        status = json.loads(status)
-        status_model = ClusterStatus(**status)
-        return status_model
+        status = orjson.loads(resp)
+        self._cluster_status = (time.monotonic(), status)
+        return status
+
+    async def cluster_status(self, force_refresh: bool = False) -> ClusterStatus:
+        """Fetch cluster status, see `.cluster_status_raw`"""
+        status = await self.cluster_status_raw(force_refresh=force_refresh)
+        return ClusterStatus(**status)
 
     async def create_alias(self, alias_name: str, collections: List[str]):
         url = "/solr/admin/collections?action=CREATEALIAS"
         params = dict(name=alias_name, collections=",".join(collections))
 
-        resp = await self.api_request(path=url, params=params)
+        resp = await self.api_request(path=url, params=params, max_retries=0)
         if resp is None:
             raise ValueError(f"Error creating alias {alias_name}")
 
+        self._invalidate_cluster_status()
+
     async def remove_alias(self, alias_name: str):
         url = "/solr/admin/collections?action=DELETEALIAS"
         params = dict(name=alias_name)
 
-        resp = await self.api_request(path=url, params=params)
+        resp = await self.api_request(path=url, params=params, max_retries=0)
         if resp is None:
             raise ValueError(f"Error removing alias {alias_name}")
 
+        self._invalidate_cluster_status()
+
     async def analyzer_step(self, field: str, analyzer: str, text: str):
         url = f"/solr/{self.collection}/analysis/field"
         params = {
@@ -174,7 +373,7 @@ class ApiEngine:
         if resp is None:
             raise ValueError("Error fetching analysis result")
 
-        data = json.loads(resp)
+        data = orjson.loads(resp)
         analysis = AnalysisModel(**data)
 
         parsed_tokens = []
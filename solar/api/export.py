@@ -1,8 +1,10 @@
 import asyncio
-import datetime
+import contextlib
+import gzip
 import logging
 import pathlib
-from typing import List, Optional, Union
+import time
+from typing import AsyncIterator, List, Optional, Tuple, Union
 
 import orjson
 from rich import print
@@ -10,9 +12,15 @@ from rich.progress import Progress
 
 from solar.api.base import ApiEngine
 from solar.types.config_files import ConfigFiles
+from solar.utils import run_in_thread
 
 logger = logging.getLogger("root")
 
+QUERY_OPERATOR = "OR"
+NESTED_FL = "*, [child limit=-1]"
+# responses bigger than this are parsed in thread, so other batches keep downloading
+THREAD_PARSE_THRESHOLD = 64 * 1024
+
 
 class Exporter(ApiEngine):
     def __init__(
@@ -22,46 +30,100 @@ class Exporter(ApiEngine):
         username: Optional[str] = None,
         password: Optional[str] = None,
         id_col: str = "id",
+        pool_size: int = 32,
     ) -> None:
-        super().__init__(base_url, collection, username, password, id_col)
+        super().__init__(base_url, collection, username, password, id_col, pool_size)
+        self._select_path = f"/solr/{collection}/select"
+        self._sort = f"{id_col} asc"
 
     async def _get_documents(
-        self, query: str, start_row: int, rows: int, nested: bool
-    ) -> List[dict]:
-        """Fetch documents by `query`
+        self,
+        query: str,
+        rows: int,
+        nested: bool,
+        cursor_mark: str = "*",
+        extra_params: Optional[dict] = None,
+    ) -> Tuple[List[dict], str, int]:
+        """Fetch page of documents by `query` using Solr `cursorMark`
 
         Args:
             query (List[dict]): `query` for Solr
-            start_row (int): index of first document to fetch
             rows (int): number of documents to fetch
             nested (bool): fetch nested documents or not
                 if True - adds `fl=*, [child limit=-1]` to query params
+            cursor_mark (str, optional): cursor to continue from.
+                Defaults to "*" (first page).
+            extra_params (Optional[dict], optional): additional query params.
+                Defaults to None.
 
         Raises:
             ValueError: Error fetching documents
 
         Returns:
-            List[dict]: array of collection documents
+            Tuple[List[dict], str, int]: array of collection documents,
+                next cursor mark and total number of found documents
         """
-        url_path = f"/solr/{self.collection}/select"
         params = {
             "q": query,
-            "q.op": "OR",
-            "start": start_row,
+            "q.op": QUERY_OPERATOR,
             "rows": rows,
+            "sort": self._sort,
+            "cursorMark": cursor_mark,
         }
         if nested:
-            params["fl"] = "*, [child limit=-1]"
+            params["fl"] = NESTED_FL
+
+        if extra_params is not None:
+            params.update(extra_params)
 
-        content = await self.api_request(path=url_path, params=params, method="GET")
+        content = await self.api_request(
+            path=self._select_path, params=params, method="GET"
+        )
 
         if content is None:
-            print(f"[red]Error fetching document {id} ({self.collection=})")
-            raise ValueError(f"Error fetching document {id} ({self.collection=})")
+            print(f"[red]Error fetching documents ({self.collection=}, {cursor_mark=})")
+            raise ValueError(
+                f"Error fetching documents ({self.collection=}, {cursor_mark=})"
+            )
+
+        if len(content) > THREAD_PARSE_THRESHOLD:
+            data = await run_in_thread(orjson.loads, content)
+        else:
+            data = orjson.loads(content)
+
+        response = data["response"]
+        return response["docs"], data["nextCursorMark"], response["numFound"]
+
+    async def _iter_cursor(
+        self,
+        query: str,
+        rows: int,
+        nested: bool,
+        extra_params: Optional[dict] = None,
+    ) -> AsyncIterator[Tuple[int, List[dict]]]:
+        """Iterate over all documents found by `query` page by page
 
-        data = orjson.loads(content)  # type: ignore
-        doc = data["response"]["docs"]
-        return doc
+        Solr `cursorMark` is used instead of `start` offset,
+        so every page costs the same regardless of its position.
+
+        Yields:
+            Tuple[int, List[dict]]: total number of found documents and page of documents
+        """
+        cursor_mark = "*"
+        while True:
+            docs, next_cursor_mark, num_found = await self._get_documents(
+                query=query,
+                rows=rows,
+                nested=nested,
+                cursor_mark=cursor_mark,
+                extra_params=extra_params,
+            )
+            yield num_found, docs
+
+            if next_cursor_mark == cursor_mark:
+                return
+
+            cursor_mark = next_cursor_mark
 
     async def _export_to_path(
         self,
@@ -70,58 +132,143 @@ class Exporter(ApiEngine):
         nested: bool,
         batch_size: int = 10,
         name: Optional[str] = None,
+        concurrency: int = 1,
+        compress: bool = False,
+        ndjson: bool = False,
     ) -> Optional[pathlib.Path]:
         """Export documents to .json file in `path`
 
+        Documents are fetched with Solr cursor and streamed to the file
+        by a single writer, so only a few batches are kept in memory.
+        If `concurrency` > 1, collection is split into hash partitions
+        (`{!hash}` filter by `id_col`), each one is fetched by its own cursor.
+
         Args:
             query (str): `q` parameter to fetch docs from Solr
             path (str): path to save result `.json` file
             batch_size (int, optional): batch size.
                 Specifies how many documents will be fetched by one request
                 Defaults to 10.
+            concurrency (int, optional): number of concurrent cursors.
+                Defaults to 1.
+            compress (bool, optional): compress file with gzip (`.json.gz`).
+                Defaults to False.
+            ndjson (bool, optional): save as `.ndjson` - header line
+                and one document per line, which can be imported lazily.
+                Defaults to False.
 
         Returns:
             pathlib.Path: путь до итогового файла
         """
-        today = datetime.datetime.now()
-        today_str = today.strftime("%d-%m-%Y")
-        data = dict(
+        today_str = time.strftime("%d-%m-%Y")
+        header = dict(
             collection=self.collection,
             solr_url=self.base_url,
             date=today_str,
-            docs=[],
         )
 
-        ids = await self._fetch_ids(query=query)
-        if ids is None:
-            print("[red]Error fetching documents IDs")
-            return
-
-        num_ids = len(ids)
-        with Progress() as progress:
-            task = progress.add_task("Downloading...", total=num_ids)
-            for from_idx in range(0, num_ids, batch_size):
-                docs = await self._get_documents(
-                    start_row=from_idx, rows=batch_size, query=query, nested=nested
-                )
-                data["docs"] += docs  # type: ignore
-                progress.update(task, advance=batch_size)
-
         if isinstance(path, str):
             file_directory = pathlib.Path(path)
         else:
             file_directory = path
 
-        if not file_directory.exists():
-            file_directory.mkdir()
+        file_directory.mkdir(parents=True, exist_ok=True)
 
         if name is None:
-            filepath = file_directory / f"{self.collection}_{today_str}.json"
+            suffix = ".ndjson" if ndjson else ".json"
+            if compress:
+                suffix += ".gz"
+            filepath = file_directory / f"{self.collection}_{today_str}{suffix}"
         else:
             filepath = file_directory / name
 
-        with open(filepath, "w", encoding="UTF-8") as f:
-            f.write(orjson.dumps(data).decode("utf-8"))  # type: ignore
+        if concurrency > 1:
+            partitions: List[Optional[dict]] = [
+                {
+                    "fq": f"{{!hash workers={concurrency} worker={worker}}}",
+                    "partitionKeys": self.id_col,
+                }
+                for worker in range(concurrency)
+            ]
+        else:
+            partitions = [None]
+
+        batches: asyncio.Queue = asyncio.Queue(maxsize=2 * len(partitions))
+        total = 0
+
+        async def fetch(progress: Progress, task, extra_params: Optional[dict]):
+            nonlocal total
+            first = True
+            async for num_found, docs in self._iter_cursor(
+                query=query, rows=batch_size, nested=nested, extra_params=extra_params
+            ):
+                if first:
+                    total += num_found
+                    progress.update(task, total=total)
+                    first = False
+
+                await batches.put(docs)
+
+        async def write(f, progress: Progress, task):
+            first = True
+            while True:
+                docs = await batches.get()
+                if docs is None:
+                    return
+
+                if docs and ndjson:
+                    chunk = b"".join(
+                        orjson.dumps(doc, option=orjson.OPT_APPEND_NEWLINE)
+                        for doc in docs
+                    )
+                    await run_in_thread(f.write, chunk)
+                elif docs:
+                    # strip array brackets without copying serialized batch
+                    chunk = memoryview(orjson.dumps(docs))[1:-1]
+                    if first:
+                        await run_in_thread(f.write, chunk)
+                        first = False
+                    else:
+                        await run_in_thread(f.writelines, (b",", chunk))
+
+                progress.update(task, advance=len(docs))
+
+        async def produce(progress: Progress, task):
+            await asyncio.gather(
+                *(fetch(progress, task, partition) for partition in partitions)
+            )
+            await batches.put(None)
+
+        if ndjson:
+            head = orjson.dumps(header, option=orjson.OPT_APPEND_NEWLINE)
+            tail = b""
+        else:
+            # header without closing brace, docs array is appended by writer
+            head = orjson.dumps(header)[:-1] + b',"docs":['
+            tail = b"]}"
+
+        with contextlib.ExitStack() as stack:
+            f = stack.enter_context(open(filepath, "wb", buffering=1 << 20))
+            if compress:
+                # fast level, compression runs in writer thread along with writes
+                f = stack.enter_context(
+                    gzip.GzipFile(fileobj=f, mode="wb", compresslevel=1)
+                )
+
+            progress = stack.enter_context(Progress())
+            task = progress.add_task("Downloading...", total=None)
+            await run_in_thread(f.write, head)
+
+            producer = asyncio.ensure_future(produce(progress, task))
+            writer = asyncio.ensure_future(write(f, progress, task))
+            try:
+                await asyncio.gather(producer, writer)
+            except BaseException:
+                producer.cancel()
+                writer.cancel()
+                raise
+
+            await run_in_thread(f.write, tail)
 
         return filepath
 
@@ -131,7 +278,10 @@ class Exporter(ApiEngine):
         query: str = "*:*",
         nested: bool = False,
         name: Optional[str] = None,
-        batch_size: Optional[int] = 50,
+        batch_size: int = 50,
+        concurrency: int = 1,
+        compress: bool = False,
+        ndjson: bool = False,
     ) -> Optional[pathlib.Path]:
         """Export Solr collection to `path`
 
@@ -139,15 +289,30 @@ class Exporter(ApiEngine):
             path (str): path to save result `.json` file
             query (str, optional): `q` parameter to fetch docs from Solr
                 Defaults to "*:*".
+            concurrency (int, optional): number of concurrent cursors.
+                Values > 1 require `id_col` to have docValues.
+                Defaults to 1.
+            compress (bool, optional): compress file with gzip (`.json.gz`).
+                Defaults to False.
+            ndjson (bool, optional): save as `.ndjson`, one document per line.
+                Defaults to False.
 
         Returns:
             Optional[pathlib.Path]: result `.json` path
         """
         print(f"Export nested documents: {nested}")
         print(f"Batch size: {batch_size}")
+        print(f"Concurrency: {concurrency}")
 
         filepath = await self._export_to_path(
-            path=path, query=query, nested=nested, name=name, batch_size=batch_size
+            path=path,
+            query=query,
+            nested=nested,
+            name=name,
+            batch_size=batch_size,
+            concurrency=concurrency,
+            compress=compress,
+            ndjson=ndjson,
         )
 
         return filepath
@@ -165,13 +330,12 @@ class Exporter(ApiEngine):
         if isinstance(path, str):
             path = pathlib.Path(path)
 
-        if not path.exists():
-            path.mkdir()
+        path.mkdir(parents=True, exist_ok=True)
 
         # url = "/solr/admin/zookeeper?detail=true&path=/configs/&wt=json"
         url = f"/solr/{collection_name}/admin/file?wt=json"
 
-        resp: Optional[str] = await self.api_request(path=url)
+        resp: Optional[bytes] = await self.api_request(path=url)
         if resp is None:
             raise ValueError("Error fetching config info :(")
 
@@ -187,45 +351,58 @@ class Exporter(ApiEngine):
     async def _parse_tree(
         self, tree: ConfigFiles, folder: pathlib.Path, config_name: Optional[str]
     ):
-        """Recursive Zookeeper file tree parsing"""
+        """Recursive Zookeeper file tree parsing.
+        Files and subdirectories of one level are fetched concurrently"""
+        tasks = []
         for filename, fileinfo in tree.files.items():
             if fileinfo.directory:
-                url = f"/solr/{config_name}/admin/file?file={filename}&wt=json"
-                resp = await self.api_request(path=url)
-                if resp is None:
-                    raise ValueError(f"Error fetching dir {filename} files")
-
-                data: dict = orjson.loads(resp)
-                dir_files = ConfigFiles(**data)
-                dir_folder = folder / filename
-                if not dir_folder.exists():
-                    dir_folder.mkdir()
-
-                dir_files.path += f"{filename}/"
-
-                await self._parse_tree(
-                    tree=dir_files, folder=dir_folder, config_name=config_name
+                task = self._parse_dir(
+                    tree=tree, dirname=filename, folder=folder, config_name=config_name
                 )
-
             else:
-                file_path: pathlib.Path = folder / filename
+                task = self._export_file(
+                    tree=tree, filename=filename, folder=folder, config_name=config_name
+                )
+            tasks.append(task)
 
-                if tree.path:
-                    url = f"/solr/{config_name}/admin/file?file={tree.path}{filename}&wt=json"
-                else:
-                    url = f"/solr/{config_name}/admin/file?file={filename}&wt=json"
+        await asyncio.gather(*tasks)
 
-                resp: Optional[str] = await self.api_request(
-                    path=url,
-                )
-                if resp is None:
-                    raise ValueError(f"Error fetching document body: {filename}")
+    async def _parse_dir(
+        self,
+        tree: ConfigFiles,
+        dirname: str,
+        folder: pathlib.Path,
+        config_name: Optional[str],
+    ):
+        """Fetch Zookeeper directory listing and parse it"""
+        url = f"/solr/{config_name}/admin/file?file={tree.path}{dirname}&wt=json"
+        resp = await self.api_request(path=url)
+        if resp is None:
+            raise ValueError(f"Error fetching dir {dirname} files")
 
-                self._write_file(path=folder / filename, content=resp)
+        data: dict = orjson.loads(resp)
+        dir_files = ConfigFiles(**data)
+        dir_folder = folder / dirname
+        dir_folder.mkdir(parents=True, exist_ok=True)
 
-    def _write_file(self, path: pathlib.Path, content: str):
-        with open(path, "w", encoding="UTF-8") as f:
-            f.write(content)
+        dir_files.path = f"{tree.path}{dirname}/"
+
+        await self._parse_tree(
+            tree=dir_files, folder=dir_folder, config_name=config_name
+        )
+
+    async def _export_file(
+        self,
+        tree: ConfigFiles,
+        filename: str,
+        folder: pathlib.Path,
+        config_name: Optional[str],
+    ):
+        """Fetch Zookeeper file body and save it to `folder`"""
+        url = f"/solr/{config_name}/admin/file?file={tree.path}{filename}&wt=json"
+        ok = await self.download_to_file(path=url, file_path=folder / filename)
+        if not ok:
+            raise ValueError(f"Error fetching document body: {filename}")
 
 
 if __name__ == "__main__":
@@ -1,10 +1,15 @@
-import json
+import asyncio
+import gzip
 import logging
+import mmap
+import operator
 import os
 import pathlib
-import time
-from typing import List, Optional, Union
+import tempfile
+import zipfile
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
+import orjson
 from more_itertools import chunked
 from rich import print
 from rich.progress import (
@@ -16,70 +21,103 @@ from rich.progress import (
 )
 
 from solar.api.base import ApiEngine
+from solar.utils import ask_confirm, run_in_thread
 
 logger = logging.getLogger("root")
 
+# service fields, which Solr rejects or rebuilds on import
+SERVICE_FIELDS = ("_version_", "_root_")
+UPDATE_HEADERS = {"Content-type": "application/json"}
+UPDATE_PARAMS = {"overwrite": "true", "wt": "json"}
+
+
+def remove_fields(docs: Union[dict, list], fields: Tuple[str, ...]):
+    """Remove `fields` from documents and all nested documents in place"""
+    stack = [docs]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            for field in fields:
+                node.pop(field, None)
+            values = node.values()
+        else:
+            values = node
+
+        stack.extend(v for v in values if isinstance(v, (dict, list)))
+
+
+def zip_folder(folder: pathlib.Path, fileobj: BinaryIO):
+    """Write all files of `folder` to zip archive `fileobj`,
+    with paths relative to `folder`"""
+    with zipfile.ZipFile(
+        fileobj, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1
+    ) as zf:
+        for root, _, filenames in os.walk(folder):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                zf.write(path, os.path.relpath(path, folder))
+
 
-def recursive_field_remove(doc: dict, field: str):
-    if not isinstance(doc, (dict, list)):
-        return doc
-    if isinstance(doc, list):
-        return [recursive_field_remove(v, field) for v in doc]
-    return {k: recursive_field_remove(v, field) for k, v in doc.items() if k != field}
+def iter_ndjson(path: str) -> Iterator[dict]:
+    """Iterate over records of `.ndjson` (or gzipped `.ndjson.gz`) file"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                yield orjson.loads(line)
 
 
 class Importer(ApiEngine):
     """Class with *import* methods"""
 
     def _load_json(self, path: Union[str, pathlib.Path]):
-        """Load source `.json` file"""
+        """Load source `.json` (or gzipped `.json.gz`) file"""
 
         if isinstance(path, pathlib.Path):
             path_str = path.absolute().__str__()
         else:
             path_str = path
 
-        with open(path_str, "r", encoding="UTF-8") as f:
-            data = json.load(f)
+        if path_str.endswith(".gz"):
+            with gzip.open(path_str, "rb") as f:
+                data = orjson.loads(f.read())
+        else:
+            with open(path_str, "rb") as f:
+                # empty file can't be mapped
+                if os.fstat(f.fileno()).st_size == 0:
+                    raise ValueError(f"Empty source file {path_str}")
+
+                # file is parsed straight from page cache, without copy to bytes object
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    data = orjson.loads(memoryview(mm))
 
         if self.collection is None:
             self.collection = data["collection"]
         return data
 
-    async def _post_documents(self, docs: List[dict], collection_name: str):
+    async def _post_documents(
+        self, docs: List[dict], collection_name: str, commit_within: int = 60_000
+    ):
         """Send documents to Solr.
 
         Args:
             docs (List[dict]): array of docs
+            commit_within (int, optional): milliseconds for Solr to commit docs within.
+                Defaults to 60000.
 
         Raises:
             ValueError: error sending docs
         """
-        curr_time = round(time.time() * 1000)
-        for doc in docs:
-            doc.pop("_version_", None)
-            doc = recursive_field_remove(doc, "_root_")
+        remove_fields(docs, SERVICE_FIELDS)
 
-        url_path = f"/solr/{collection_name}/update"
-        headers = {
-            "Content-type": "application/json",
-        }
-
-        params = {
-            "_": curr_time,
-            "commitWithin": "5000",
-            "overwrite": "true",
-            "wt": "json",
-        }
-
-        doc_binary = json.dumps(docs, ensure_ascii=False).encode("utf-8")
+        doc_binary = orjson.dumps(docs)
 
         res = await self.api_request(
             method="POST",
-            path=url_path,
+            path=f"/solr/{collection_name}/update",
             data=doc_binary,
-            headers=headers,
-            params=params,
+            headers=UPDATE_HEADERS,
+            params={**UPDATE_PARAMS, "commitWithin": str(commit_within)},
         )
         return res
 
@@ -89,64 +127,120 @@ class Importer(ApiEngine):
         batch_size: int = 50,
         overwrite: bool = True,
         collection: Optional[str] = None,
+        concurrency: int = 4,
+        confirm: bool = True,
+        commit_within: int = 60_000,
     ):
-        """Import data, saved as `.json` file
+        """Import data, saved as `.json` or `.ndjson` file.
+        `.ndjson` files are read lazily, unless `overwrite` is False
 
         Args:
-            path (str): source `.json` path
+            path (str): source `.json` / `.ndjson` path (can be gzipped)
             batch_size (int, optional): how many documents will be sent by one request.
                 Defaults to 50.
+            concurrency (int, optional): how many requests are sent concurrently.
+                Defaults to 4.
+            confirm (bool, optional): ask user to confirm import params.
+                Defaults to True.
+            commit_within (int, optional): milliseconds for Solr to commit
+                uploaded docs within. Explicit commit is sent after import anyway.
+                Defaults to 60000.
         """
-        data = self._load_json(path)
-        docs = data["docs"]
-        docs_ids = set([i[self.id_col] for i in docs])
-
-        print(f"Number of docs: {len(docs_ids)}")
-        if not overwrite:
-            print("Fetching IDs of collection documents...")
-            existing_ids = await self._fetch_ids(query="*:*")
-            if existing_ids is None:
-                raise ValueError("Error fetching collection IDs :(")
-
-            print(f"Number of docs found: {len(existing_ids)}")
-            existing_ids = set(existing_ids)
-            upload_ids = docs_ids - existing_ids
-
-            print(f"{len(upload_ids)} docs will be created")
-            seen = set()
-            upload_docs = []
-            for doc in docs:
-                doc_id = doc[self.id_col]
-                if doc_id not in seen and doc_id in upload_ids:
-                    upload_docs.append(doc)
-                    seen.add(doc_id)
-        else:
-            upload_docs = docs
-
-        del docs
-        del data
-
-        if len(upload_docs) == 0:
-            print("No documents to import :(")
-            return
-
-        if collection is None:
-            collection_name: str = self.collection
+        path_str = str(path)
+        stream = ".ndjson" in pathlib.PurePath(path_str).suffixes
+        if stream:
+            # documents are read from file lazily, batch by batch
+            records = iter_ndjson(path_str)
+            header = await run_in_thread(next, records, None)
+            if header is None:
+                raise ValueError(f"Empty source file {path_str}")
+
+            if self.collection is None:
+                self.collection = header["collection"]
+
+            docs: Iterable[dict] = records
+            num_docs: Optional[int] = None
         else:
-            collection_name = collection
-
-        print("Begin import with params:")
-        print(f"Source file: [bold]{path}")
-        print(f"Batch size: [bold]{batch_size}")
-        print(f"Collection: [bold]{collection_name}")
-
-        confirm = input("Correct? (y/n)").lower() == "y"
-        if not confirm:
-            print("[red]Отмена...")
-            return
+            data = await run_in_thread(self._load_json, path)
+            docs = data["docs"]
+            del data
+            num_docs = len(docs)
+            print(f"Number of docs: {num_docs}")
+
+        try:
+            if not overwrite:
+                docs = await run_in_thread(list, docs)
+                docs = await self._filter_existing(docs)
+                num_docs = len(docs)
+
+            if num_docs == 0:
+                print("No documents to import :(")
+                return
+
+            if collection is None:
+                collection_name: str = self.collection  # type: ignore
+            else:
+                collection_name = collection
+
+            print("Begin import with params:")
+            print(f"Source file: [bold]{path}")
+            print(f"Batch size: [bold]{batch_size}")
+            print(f"Concurrency: [bold]{concurrency}")
+            print(f"Collection: [bold]{collection_name}")
+
+            if confirm and not await ask_confirm("Correct? (y/n)"):
+                print("[red]Отмена...")
+                return
+
+            await self._upload(
+                docs=docs,
+                num_docs=num_docs,
+                collection_name=collection_name,
+                batch_size=batch_size,
+                concurrency=concurrency,
+                commit_within=commit_within,
+            )
+            print("Committing...")
+            await self.commit(collection_name)
+        finally:
+            if stream:
+                records.close()
+
+    async def _filter_existing(self, docs: List[dict]) -> List[dict]:
+        """Keep only documents, which are not in collection yet.
+        Duplicates in `docs` are removed too"""
+        get_id = operator.itemgetter(self.id_col)
+        print("Fetching IDs of collection documents...")
+        existing_ids = await self._fetch_ids(query="*:*")
+        if existing_ids is None:
+            raise ValueError("Error fetching collection IDs :(")
+
+        print(f"Number of docs found: {len(existing_ids)}")
+        existing = set(existing_ids)
+
+        # dict keeps first document of every new ID in original order
+        upload: Dict[str, dict] = {}
+        for doc in docs:
+            doc_id = get_id(doc)
+            if doc_id not in existing and doc_id not in upload:
+                upload[doc_id] = doc
 
-        num_docs = len(upload_docs)
+        print(f"{len(upload)} docs will be created")
+        upload_docs = list(upload.values())
+        return upload_docs
 
+    async def _upload(
+        self,
+        docs: Iterable[dict],
+        num_docs: Optional[int],
+        collection_name: str,
+        batch_size: int,
+        concurrency: int,
+        commit_within: int,
+    ):
+        """Send `docs` to Solr by `concurrency` workers.
+        Batches are read from `docs` in thread, so `docs` can lazily read a file
+        """
         with Progress(
             TextColumn("[progress.description]{task.description}"),
             BarColumn(),
@@ -156,19 +250,54 @@ class Importer(ApiEngine):
         ) as progress:
             task = progress.add_task("Uploading...", total=num_docs)
 
-            for batch_docs in chunked(upload_docs, batch_size):
-                try:
-                    await self._post_documents(
-                        docs=batch_docs, collection_name=collection_name
-                    )
-                except Exception:
-                    print("[red]Ошибка :)")
+            batches = chunked(docs, batch_size)
+            queue: asyncio.Queue = asyncio.Queue(maxsize=2 * concurrency)
+
+            async def read():
+                while True:
+                    batch_docs = await run_in_thread(next, batches, None)
+                    if batch_docs is None:
+                        break
+
+                    await queue.put(batch_docs)
+
+                for _ in range(concurrency):
+                    await queue.put(None)
+
+            async def upload():
+                while True:
+                    batch_docs = await queue.get()
+                    if batch_docs is None:
+                        return
 
-                progress.update(task, advance=batch_size)
+                    try:
+                        await self._post_documents(
+                            docs=batch_docs,
+                            collection_name=collection_name,
+                            commit_within=commit_within,
+                        )
+                    except Exception:
+                        logger.exception(
+                            f"Error importing batch of {len(batch_docs)} docs"
+                        )
+
+                    progress.update(task, advance=len(batch_docs))
+
+            await asyncio.gather(read(), *(upload() for _ in range(concurrency)))
+
+    async def commit(self, collection_name: str):
+        """Commit all uploaded documents, so they become searchable"""
+        resp = await self.api_request(
+            method="POST",
+            path=f"/solr/{collection_name}/update",
+            params={"commit": "true", "wt": "json"},
+        )
+        if resp is None:
+            raise ValueError(f"Error committing collection {collection_name}")
 
     async def _remove_config(self, name: str):
         url = f"/api/cluster/configs/{name}?omitHeader=true"
-        r = await self.api_request(method="DELETE", path=url)
+        r = await self.api_request(method="DELETE", path=url, max_retries=0)
         if r is None:
             raise ValueError("Error deleting config :(")
 
@@ -176,15 +305,18 @@ class Importer(ApiEngine):
 
     async def create_collection(self, collection_name: str, config_name: str):
         url = f"/solr/admin/collections?action=CREATE&name={collection_name}&numShards=1&replicationFactor=1&maxShardsPerNode=1&collection.configName={config_name}"
-        r = await self.api_request(path=url)
+        r = await self.api_request(path=url, max_retries=0)
         if r is None:
             raise ValueError("Error creating collection :(")
 
+        self._invalidate_cluster_status()
+
     async def import_configs(
         self,
         configs_path: Union[str, pathlib.Path],
         overwrite: bool = False,
         name: Optional[str] = None,
+        confirm: bool = True,
     ):
         """Import config
 
@@ -195,13 +327,12 @@ class Importer(ApiEngine):
             name (Optional[str], optional): create config with this name
                 if `None` - source folder name will be used
                 Defaults to None.
+            confirm (bool, optional): ask user to confirm import params.
+                Defaults to True.
 
         Raises:
             ValueError: Error importing config
         """
-        import io
-        import zipfile
-
         overwrite_str = "true" if overwrite else "false"
         cleanup_str = overwrite_str
 
@@ -215,8 +346,7 @@ class Importer(ApiEngine):
         print(f"Source config: [bold]{name}[/bold]")
         print(f"Overwrite: [bold]{overwrite}[/bold]")
 
-        confirm = input("Correct? (y/n)")
-        if confirm.lower() != "y":
+        if confirm and not await ask_confirm("Correct? (y/n)"):
             print("[red]Stopping...")
             os._exit(1)
 
@@ -229,12 +359,10 @@ class Importer(ApiEngine):
         params = dict(
             action="UPLOAD", name=name, overwrite=overwrite_str, cleanup=cleanup_str
         )
-        with io.BytesIO() as f:
-            with zipfile.ZipFile(f, "w") as zf:
-                for path in configs_path.rglob("*"):
-                    rel_path = path.relative_to(configs_path)
-                    zf.write(path, rel_path)
-
+        # archive is built in temporary file and streamed from disk,
+        # so it is never loaded to memory
+        with tempfile.TemporaryFile() as f:
+            await run_in_thread(zip_folder, configs_path, f)
             f.seek(0)
 
             resp = await self.api_request(
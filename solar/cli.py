@@ -1,6 +1,6 @@
 import asyncio
-import datetime
 import pathlib
+import time
 import urllib.parse
 from functools import wraps
 
@@ -10,13 +10,21 @@ from rich import print
 from solar.api.base import ApiEngine
 from solar.api.export import Exporter
 from solar.api.import_ import Importer
-from solar.types.cluster_status import Collection
+from solar.utils import ask_confirm
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 
 def coro(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
-        return asyncio.get_event_loop().run_until_complete(f(*args, **kwargs))
+        if uvloop is not None:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+        return asyncio.run(f(*args, **kwargs))
 
     return wrapper
 
@@ -25,8 +33,15 @@ def coro(f):
 @click.option("-q", "--query", help="Solr query. Default: *:*", default="*:*")
 @click.argument("URL", nargs=1)
 @click.option("-c", "--collection", default=None)
+@click.option(
+    "-y",
+    "--yes",
+    is_flag=True,
+    default=False,
+    help="Do not ask for confirmations. Default: False",
+)
 @click.pass_context
-def cli(ctx, query: str, collection: str, url: str):
+def cli(ctx, query: str, collection: str, url: str, yes: bool):
     """Solr CLI"""
     url_parsed = urllib.parse.urlparse(url)
     if url_parsed.scheme not in ("http", "https"):
@@ -36,14 +51,25 @@ def cli(ctx, query: str, collection: str, url: str):
     username = url_parsed.username
     password = url_parsed.password
 
-    url_str = f"{url_parsed.scheme}://{url_parsed.hostname}:{url_parsed.port}{url_parsed.path}"
+    # credentials are passed with basic auth, so they are removed from URL
+    # host is kept as written, so IPv6 address keeps its brackets
+    netloc = url_parsed.netloc.rpartition("@")[2]
+
+    url_str = urllib.parse.urlunparse(
+        (url_parsed.scheme, netloc, url_parsed.path.rstrip("/"), "", "", "")
+    )
 
     ctx.ensure_object(dict)
     ctx.obj["query"] = query
     ctx.obj["url"] = url_str
     ctx.obj["collection"] = collection
-    ctx.obj["username"] = username
-    ctx.obj["password"] = password
+    ctx.obj["yes"] = yes
+    ctx.obj["engine"] = ApiEngine(
+        base_url=url_str,
+        collection=collection,
+        username=username,
+        password=password,
+    )
 
 
 @cli.command(name="remove-config")
@@ -52,16 +78,11 @@ def cli(ctx, query: str, collection: str, url: str):
 @coro
 async def remove_config(ctx, name):
     """Remove config from Solr"""
-    ctx.ensure_object(dict)
-    importer = Importer(
-        base_url=ctx.obj["url"],
-        collection=ctx.obj["collection"],
-        username=ctx.obj["username"],
-        password=ctx.obj["password"],
-    )
+    importer = Importer.from_engine(ctx.obj["engine"])
     try:
-        confirm = input(f"You sure you want to delete config {name}?").lower() == "y"
-        if not confirm:
+        if not ctx.obj["yes"] and not await ask_confirm(
+            f"You sure you want to delete config {name}?"
+        ):
             return
 
         await importer.build_client()
@@ -73,16 +94,20 @@ async def remove_config(ctx, name):
 
 
 @cli.command(name="reindex")
-@click.option("--cpath", default=None, help="New config path")
-@click.option("--cname", default=None, help="New config name")
+@click.option("--cpath", "config_path", default=None, help="New config path")
+@click.option(
+    "--cname",
+    "config_name",
+    default=None,
+    help="New config name. Default: <collection>_<date>",
+)
 @click.argument("directory")
 @click.pass_context
 @coro
 async def reindex_collection(ctx, config_path, config_name, directory):
     """Reindex collection"""
     work_dir = pathlib.Path(directory)
-    if not work_dir.exists():
-        work_dir.mkdir()
+    work_dir.mkdir(parents=True, exist_ok=True)
 
     if ctx.obj["collection"] is None:
         print("[bold red]Connection parament have to specified")
@@ -90,40 +115,24 @@ async def reindex_collection(ctx, config_path, config_name, directory):
 
     collection_name = ctx.obj["collection"].strip()
 
-    ctx.ensure_object(dict)
-    importer = Importer(
-        base_url=ctx.obj["url"],
-        collection=ctx.obj["collection"],
-        username=ctx.obj["username"],
-        password=ctx.obj["password"],
-    )
-    exporter = Exporter(
-        base_url=ctx.obj["url"],
-        collection=ctx.obj["collection"],
-        username=ctx.obj["username"],
-        password=ctx.obj["password"],
-    )
+    importer = Importer.from_engine(ctx.obj["engine"])
 
     try:
+        # exporter shares importer connections
         await importer.build_client()
-        await exporter.build_client()
+        exporter = Exporter.from_engine(importer)
 
-        cluster_status = await exporter.cluster_status()
-        collections = cluster_status.cluster.collections
-
-        collections_filtered = [
-            data for name, data in collections.items() if name == collection_name
-        ]
-        if len(collections_filtered) == 0:
+        # only config name is needed, so status is not validated by model
+        cluster_status = await exporter.cluster_status_raw()
+        collections = cluster_status["cluster"]["collections"]
+        if collection_name not in collections:
             print(f"[red]Collection {collection_name} not found :(")
             return
 
-        collection: Collection = collections_filtered[0]
+        current_config_name = collections[collection_name]["configName"]
         if config_name is None:
-            config_name = collection.configName
-
-        now = datetime.datetime.now()
-        now_str = now.strftime("%d_%m_%Y_%H_%M")
+            now_str = time.strftime("%d_%m_%Y_%H_%M")
+            config_name = f"{collection_name}_{now_str}"
 
         tmp_config_path = work_dir / "config"
         tmp_data_dir_path = work_dir / "data"
@@ -132,19 +141,27 @@ async def reindex_collection(ctx, config_path, config_name, directory):
         tmp_data_path = tmp_data_dir_path / collection_filename
 
         if config_path is None:
-            print(f"Exporting config {collection.configName}")
+            print(f"Exporting config {current_config_name}")
             config_path = await exporter.export_config(
                 path=tmp_config_path, collection_name=collection_name
             )
             print("[green]Config exported")
 
         print("Exporting data...", end=" ")
-        await exporter.export_data(path=tmp_data_dir_path)
+        await exporter.export_data(path=tmp_data_dir_path, name=collection_filename)
         print("[green]Success")
 
+        if not ctx.obj["yes"] and not await ask_confirm(
+            f"Collection {collection_name} will be removed and created again "
+            f"with config {config_name}. Correct? (y/n)"
+        ):
+            print("[red]Stopping...")
+            return
+
+        # old collection is removed only after new config is uploaded,
+        # so failed upload leaves it untouched
         print("Importing config")
-        new_config_name = f"{collection_name}_{now_str}"
-        await importer.import_configs(tmp_config_path, name=new_config_name)
+        await importer.import_configs(config_path, name=config_name, confirm=False)
         print("[green]Success")
 
         print(f"Removing old collection {collection_name}")
@@ -153,18 +170,20 @@ async def reindex_collection(ctx, config_path, config_name, directory):
 
         print("Creating new collection")
         await importer.create_collection(
-            collection_name=collection_name, config_name=new_config_name
+            collection_name=collection_name, config_name=config_name
         )
         print("[green]Success")
 
         print(f"Importing data to collection [bold]{collection_name}")
-        await importer.import_data(path=tmp_data_path, collection=collection_name)
+        await importer.import_data(
+            path=tmp_data_path, collection=collection_name, confirm=False
+        )
         print("[green]Success")
-    except Exception:
+    except Exception as e:
+        print(f"[bold red]Reindex failed: {e}")
         return
     finally:
         await importer.close_client()
-        await exporter.close_client()
 
 
 @cli.command(name="analyzer-step")
@@ -175,18 +194,11 @@ async def reindex_collection(ctx, config_path, config_name, directory):
 @coro
 async def analyzer_step(ctx, field, analyzer, text):
     """Remove config from Solr"""
-    ctx.ensure_object(dict)
-
     if ctx.obj["collection"] is None:
         print("[red]Missing --collection flag")
         return
 
-    engine = ApiEngine(
-        base_url=ctx.obj["url"],
-        collection=ctx.obj["collection"],
-        username=ctx.obj["username"],
-        password=ctx.obj["password"],
-    )
+    engine = ctx.obj["engine"]
     try:
         await engine.build_client()
         result = await engine.analyzer_step(field=field, analyzer=analyzer, text=text)
@@ -20,25 +20,54 @@ from solar.cli import cli, coro
     default=50,
     help="Batch size",
 )
+@click.option(
+    "--concurrency",
+    type=int,
+    default=1,
+    help="Number of concurrent cursors (requires docValues on id). Default: 1",
+)
+@click.option(
+    "--gzip",
+    "compress",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Compress exported file with gzip. Default: False",
+)
+@click.option(
+    "--ndjson",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Save one document per line (.ndjson). Default: False",
+)
 @click.pass_context
 @coro
-async def export_data(ctx, directory, nested: bool, batch: int):
+async def export_data(
+    ctx,
+    directory,
+    nested: bool,
+    batch: int,
+    concurrency: int,
+    compress: bool,
+    ndjson: bool,
+):
     """Export data from Solr"""
-    ctx.ensure_object(dict)
     if ctx.obj["collection"] is None:
         print("[bold red]Параметр collection должен быть задан")
         return
 
-    exporter = Exporter(
-        base_url=ctx.obj["url"],
-        collection=ctx.obj["collection"],
-        username=ctx.obj["username"],
-        password=ctx.obj["password"],
-    )
+    exporter = Exporter.from_engine(ctx.obj["engine"])
     try:
         await exporter.build_client()
         await exporter.export_data(
-            path=directory, query=ctx.obj["query"], nested=nested, batch_size=batch
+            path=directory,
+            query=ctx.obj["query"],
+            nested=nested,
+            batch_size=batch,
+            concurrency=concurrency,
+            compress=compress,
+            ndjson=ndjson,
         )
     except Exception:
         return
@@ -57,13 +86,7 @@ async def export_configs(ctx, directory):
         return
 
     print(f"Export config to [bold]{directory}")
-    ctx.ensure_object(dict)
-    exporter = Exporter(
-        base_url=ctx.obj["url"],
-        collection=ctx.obj["collection"],
-        username=ctx.obj["username"],
-        password=ctx.obj["password"],
-    )
+    exporter = Exporter.from_engine(ctx.obj["engine"])
     try:
         await exporter.build_client()
         await exporter.export_config(
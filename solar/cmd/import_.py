@@ -7,20 +7,32 @@ from solar.cli import cli, coro
 @cli.command(name="import")
 @click.argument("filepath")
 @click.option("--batch", help="Batch size to import docs with. Default: 50", default=50)
+@click.option(
+    "--concurrency",
+    type=int,
+    default=4,
+    help="Number of concurrent requests to Solr. Default: 4",
+)
+@click.option(
+    "--commit-within",
+    type=int,
+    default=60_000,
+    help="Milliseconds for Solr to commit uploaded docs within. Default: 60000",
+)
 @click.pass_context
 @coro
-async def import_data(ctx, filepath, batch):
+async def import_data(ctx, filepath, batch, concurrency, commit_within):
     """Import data to Solr"""
-    ctx.ensure_object(dict)
-    importer = Importer(
-        base_url=ctx.obj["url"],
-        collection=ctx.obj["collection"],
-        username=ctx.obj["username"],
-        password=ctx.obj["password"],
-    )
+    importer = Importer.from_engine(ctx.obj["engine"])
     try:
         await importer.build_client()
-        await importer.import_data(path=filepath, batch_size=batch)
+        await importer.import_data(
+            path=filepath,
+            batch_size=batch,
+            concurrency=concurrency,
+            confirm=not ctx.obj["yes"],
+            commit_within=commit_within,
+        )
     except Exception:
         return
     finally:
@@ -41,17 +53,14 @@ async def import_data(ctx, filepath, batch):
 @coro
 async def import_config(ctx, directory, overwrite, name):
     """Import config to Solr"""
-    ctx.ensure_object(dict)
-    importer = Importer(
-        base_url=ctx.obj["url"],
-        collection=ctx.obj["collection"],
-        username=ctx.obj["username"],
-        password=ctx.obj["password"],
-    )
+    importer = Importer.from_engine(ctx.obj["engine"])
     try:
         await importer.build_client()
         await importer.import_configs(
-            configs_path=directory, overwrite=overwrite, name=name
+            configs_path=directory,
+            overwrite=overwrite,
+            name=name,
+            confirm=not ctx.obj["yes"],
         )
     except Exception:
         return
@@ -0,0 +1,17 @@
+import asyncio
+import functools
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+async def run_in_thread(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run blocking `func` in the default executor, so event loop is not blocked"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+async def ask_confirm(prompt: str) -> bool:
+    """Ask user for confirmation without blocking event loop"""
+    answer = await run_in_thread(input, prompt)
+    return answer.lower() == "y"